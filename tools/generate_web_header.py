@@ -17,8 +17,9 @@ def generate_web_header(source, target, env):
     print("Generating web assets header...")
     print("=" * 50)
 
-    web_src_dir = join(env.subst("$PROJECT_DIR"), "data", "www")
-    header_file = join(env.subst("$PROJECT_DIR"), "include", "web_assets.h")
+    project_dir = env.subst("$PROJECT_DIR")
+    web_src_dir = join(project_dir, "data", "www")
+    header_file = join(project_dir, "include", "web_assets.h")
 
     if not os.path.exists(web_src_dir):
         print(f"No web source directory found at {web_src_dir}")
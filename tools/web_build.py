@@ -8,94 +8,532 @@ PlatformIO pre-build script for ESP8266 web assets
 
 Import("env")
 
+import io
 import os
-import gzip
+import sys
+import json
+import inspect
+import hashlib
 import shutil
+import tarfile
 import subprocess
+import threading
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from os.path import join, isfile, dirname
 
+# SCons execs this file without __file__; locate tools/ to import the
+# compression workers from a real module the process pool can pickle
+TOOLS_DIR = dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+import web_compress
+from web_compress import (
+    GZIP_BACKEND, ZOPFLI_REQUESTED, BROTLI_REQUESTED, BROTLI_ENABLED,
+    OUTPUT_SUFFIXES, br_path, compress_one, gzip_bytes, write_file,
+)
+
+# Optional single-archive output for a bundle-aware firmware handler
+BUNDLE_ENABLED = os.environ.get("WEB_BUILD_BUNDLE") == "1"
+BUNDLE_NAME = "www.tar.gz"
+BUNDLE_INDEX_NAME = "www_index.json"
+
+COMPRESS_EXTS = frozenset({'.html', '.css', '.js', '.json'})
+SKIP_DIRS = frozenset({'node_modules', '.git'})
+
+def _scan(path):
+    """Yield DirEntry objects for compressible files under path (recursive)"""
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                if os.path.splitext(entry.name)[1] in COMPRESS_EXTS:
+                    yield entry
+            elif entry.is_dir(follow_symlinks=False) and entry.name not in SKIP_DIRS:
+                yield from _scan(entry.path)
+
+def _write_bundle(data_www_dir, data_root_dir):
+    """Pack compressible assets into one www.tar.gz plus a JSON index
+
+    Files are grouped by extension so same-MIME assets sit next to each
+    other in the archive. The index maps URL paths to [offset, length] of
+    the file data inside the uncompressed tar stream.
+
+    Returns the compressed bundle size.
+    """
+    entries = sorted(_scan(data_www_dir),
+                     key=lambda e: (os.path.splitext(e.name)[1], e.path))
+    buf = io.BytesIO()
+    index = {}
+    with tarfile.open(fileobj=buf, mode='w', format=tarfile.USTAR_FORMAT) as tar:
+        for entry in entries:
+            rel_path = os.path.relpath(entry.path, data_www_dir).replace(os.sep, '/')
+            info = tarfile.TarInfo(rel_path)
+            info.size = entry.stat().st_size
+            info.mode = 0o644
+            info.mtime = 0
+            header = info.tobuf(tar.format, tar.encoding, tar.errors)
+            index["/" + rel_path] = [tar.offset + len(header), info.size]
+            with open(entry.path, 'rb') as f:
+                tar.addfile(info, f)
+
+    compressed = gzip_bytes(buf.getvalue())
+    write_file(join(data_root_dir, BUNDLE_NAME), compressed)
+    with open(join(data_root_dir, BUNDLE_INDEX_NAME), 'w') as f:
+        json.dump(index, f, separators=(',', ':'), sort_keys=True)
+    return len(compressed)
+
+def _file_entry(st):
+    """Manifest entry for a stat result"""
+    return {"mtime": st.st_mtime_ns, "size": st.st_size}
+
+def _snapshot(path):
+    """Map rel_path -> manifest entry for compressible files under path"""
+    if not os.path.isdir(path):
+        return {}
+    return {os.path.relpath(e.path, path): _file_entry(e.stat()) for e in _scan(path)}
+
+DIST_POLL_INTERVAL = 0.2
+
+def _compress_during_build(proc, dist_dir, data_root_dir, executor, baseline):
+    """Wait for npm while compressing dist/ files as they appear
+
+    A file is submitted once its (mtime, size) is stable across two polls,
+    and again after the build if it changed since. Output goes to a .tmp
+    file next to the final .gz; the caller moves it into place once the
+    copied data/www file is confirmed identical.
+
+    Returns (stdout, stderr, early) where early maps
+    rel_path -> (file_entry, future, tmp_path).
+    """
+    output = {}
+    reader = threading.Thread(target=lambda: output.update(result=proc.communicate()))
+    reader.start()
+
+    early = {}
+    last_seen = {}
+
+    def submit(rel_path, src_path, file_entry):
+        previous = early.get(rel_path)
+        if previous is not None:
+            if previous[0] == file_entry:
+                return
+            # Let the older job finish before reusing its .tmp path; it may
+            # have failed if the file was replaced mid-read
+            try:
+                previous[1].result()
+            except OSError:
+                pass
+        # Keyed by rel_path so same-named files in different dirs never share a .tmp
+        tmp_path = join(data_root_dir, rel_path.replace(os.sep, '__') + '.gz.tmp')
+        future = executor.submit(compress_one, (src_path, tmp_path, file_entry["size"]))
+        early[rel_path] = (file_entry, future, tmp_path)
+
+    def poll(final):
+        # npm/Vite empties and rewrites dist/ while we scan it; a file or
+        # directory vanishing mid-scan just means trying again next round
+        try:
+            snapshot = _snapshot(dist_dir)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for rel_path, file_entry in snapshot.items():
+            # Leftovers from the previous build are not new output
+            if baseline.get(rel_path) == file_entry:
+                continue
+            if final or last_seen.get(rel_path) == file_entry:
+                submit(rel_path, join(dist_dir, rel_path), file_entry)
+            last_seen[rel_path] = file_entry
+
+    while reader.is_alive():
+        reader.join(DIST_POLL_INTERVAL)
+        if reader.is_alive():
+            poll(final=False)
+    if proc.returncode == 0:
+        poll(final=True)
+
+    stdout, stderr = output["result"]
+    return stdout, stderr, early
+
+def _remove_tmp(tmp_path):
+    """Remove an early compression .tmp output and its .br sibling"""
+    for path in (tmp_path, br_path(tmp_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _discard_early(early):
+    """Wait for and remove unused early compression outputs"""
+    for file_entry, future, tmp_path in early.values():
+        try:
+            future.result()
+        except OSError:
+            pass
+        _remove_tmp(tmp_path)
+
+MANIFEST_NAME = ".webbuild_manifest.json"
+BANNER = "=" * 60
+
+def _load_manifest(path):
+    """Load the incremental build manifest, empty if missing or corrupt"""
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"web_ui_hash": None, "dist_hash": None, "compressor": None, "files": {}}
+    manifest.setdefault("web_ui_hash", None)
+    manifest.setdefault("dist_hash", None)
+    manifest.setdefault("compressor", None)
+    manifest.setdefault("files", {})
+    return manifest
+
+def _save_manifest(path, manifest):
+    """Persist the incremental build manifest"""
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+# Build outputs and generated reports under web-ui/ that are not inputs
+WEB_UI_SKIP = frozenset({'node_modules', 'dist', 'dist-ssr', '.git', 'bundle-analysis.html'})
+# Hashed by content; everything else under web-ui/ by mtime
+WEB_UI_CONTENT_FILES = frozenset({'package.json', 'package-lock.json'})
+
+def _web_ui_hash(web_ui_dir):
+    """Fingerprint web-ui inputs: package manifests by content, other files by mtime
+
+    Covers src/, public/, index.html, tsconfig*.json, vite config and .env*
+    files by walking all of web-ui/ except node_modules and build output.
+    """
+    h = hashlib.sha256()
+
+    def walk(path):
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            if entry.name in WEB_UI_SKIP or entry.name.endswith('.log'):
+                continue
+            rel_path = os.path.relpath(entry.path, web_ui_dir)
+            if entry.is_dir(follow_symlinks=False):
+                walk(entry.path)
+            elif rel_path in WEB_UI_CONTENT_FILES:
+                with open(entry.path, 'rb') as f:
+                    h.update(f"{rel_path}:".encode() + hashlib.sha256(f.read()).digest() + b"\n")
+            else:
+                h.update(f"{rel_path}:{entry.stat().st_mtime_ns}\n".encode())
+
+    walk(web_ui_dir)
+    return h.hexdigest()
+
+def _dist_hash(dist_dir):
+    """Fingerprint dist/ by (rel_path, size, mtime_ns) of every file"""
+    triples = []
+
+    def walk(path):
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    walk(entry.path)
+                else:
+                    st = entry.stat()
+                    triples.append((os.path.relpath(entry.path, dist_dir), st.st_size, st.st_mtime_ns))
+
+    walk(dist_dir)
+    return hashlib.blake2b(repr(tuple(sorted(triples))).encode()).hexdigest()
+
+def _sync_tree(src_dir, dst_dir):
+    """Mirror src_dir into dst_dir, copying only new or changed files
+
+    Returns (copied, removed) counts.
+    """
+    copied = 0
+    removed = 0
+    os.makedirs(dst_dir, exist_ok=True)
+    with os.scandir(src_dir) as it:
+        src_entries = {entry.name: entry for entry in it}
+
+    for name, entry in src_entries.items():
+        dst_path = join(dst_dir, name)
+        if entry.is_dir(follow_symlinks=False):
+            if isfile(dst_path):
+                os.remove(dst_path)
+            sub_copied, sub_removed = _sync_tree(entry.path, dst_path)
+            copied += sub_copied
+            removed += sub_removed
+            continue
+
+        src_st = entry.stat()
+        try:
+            dst_st = os.stat(dst_path)
+        except FileNotFoundError:
+            dst_st = None
+        if dst_st is not None and not isfile(dst_path):
+            shutil.rmtree(dst_path)
+            dst_st = None
+        # copy2 preserves mtime, so any mismatch means the source changed
+        if (dst_st is None or dst_st.st_size != src_st.st_size
+                or dst_st.st_mtime_ns != src_st.st_mtime_ns):
+            shutil.copy2(entry.path, dst_path)
+            copied += 1
+
+    # Remove files that no longer exist in the source tree
+    with os.scandir(dst_dir) as it:
+        for entry in it:
+            if entry.name in src_entries:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+            removed += 1
+
+    return copied, removed
+
+def _list_outputs(data_root_dir):
+    """Names of the .gz/.br files in data_root_dir (one directory read, no stat)"""
+    with os.scandir(data_root_dir) as it:
+        return {entry.name for entry in it if entry.name.endswith(OUTPUT_SUFFIXES)}
+
+def _outputs_present(manifest, outputs):
+    """True if every output recorded in the manifest (and the bundle) is in outputs"""
+    if BUNDLE_ENABLED and BUNDLE_NAME not in outputs:
+        return False
+    return all(os.path.basename(rel_path) + suffix in outputs
+               for rel_path in manifest["files"] for suffix in OUTPUT_SUFFIXES)
+
+PROCESS_POOL_MIN_BYTES = 4 * 1024 * 1024
+
+def _pick_executor(manifest, dist_dir):
+    """Thread pool for typical web trees, process pool for very large ones
+
+    The compressors release the GIL, so threads parallelize without the
+    process startup and pickling cost. The input size is estimated from
+    the previous build's manifest, or from dist/ on a first build.
+
+    Everything submitted to the pool must come from web_compress (or the
+    stdlib): functions defined in this SConscript cannot be pickled.
+    """
+    sizes = [entry["size"] for entry in manifest["files"].values()]
+    if not sizes:
+        sizes = [entry["size"] for entry in _snapshot(dist_dir).values()]
+    if sum(sizes) > PROCESS_POOL_MIN_BYTES:
+        return ProcessPoolExecutor
+    return ThreadPoolExecutor
+
 def build_and_prepare_web_ui(source, target, env):
     """Build Web UI, compress, and prepare for LittleFS"""
-    print("=" * 60)
-    print("Building and preparing Web UI for LittleFS...")
-    print("=" * 60)
+    # The hook may fire more than once per invocation; only build once
+    if getattr(env, "_web_built", False):
+        return
+    env._web_built = True
 
     project_dir = env.subst("$PROJECT_DIR")
+    manifest = _load_manifest(join(project_dir, "data", MANIFEST_NAME))
+    executor_class = _pick_executor(manifest, join(project_dir, "web-ui", "dist"))
+    with executor_class(max_workers=os.cpu_count()) as executor:
+        _prepare_web_ui(project_dir, manifest, executor)
+
+def _prepare_web_ui(project_dir, manifest, executor):
+    """Run the build/compress/summary steps using a shared worker pool"""
+    print(BANNER)
+    print("Building and preparing Web UI for LittleFS...")
+    print(BANNER)
+
     web_ui_dir = join(project_dir, "web-ui")
     data_www_dir = join(project_dir, "data", "www")
     data_root_dir = join(project_dir, "data")
+    manifest_path = join(data_root_dir, MANIFEST_NAME)
+
+    if ZOPFLI_REQUESTED and web_compress.zopfli is None:
+        print("⚠️  WEB_BUILD_ZOPFLI=1 but zopfli is not installed (pip install zopfli), using " + GZIP_BACKEND)
+    if BROTLI_REQUESTED and web_compress.brotli is None:
+        print("⚠️  WEB_BUILD_BROTLI=1 but brotli is not installed (pip install brotli), skipping .br output")
+
+    # Outputs from a different compressor are stale (e.g. dev -> release build)
+    compressor = GZIP_BACKEND + ("+brotli" if BROTLI_ENABLED else "")
+    if manifest["compressor"] != compressor:
+        if not BROTLI_ENABLED:
+            for rel_path in manifest["files"]:
+                stale_br = join(data_root_dir, os.path.basename(rel_path) + '.br')
+                if os.path.exists(stale_br):
+                    os.remove(stale_br)
+        manifest["dist_hash"] = None
+        manifest["files"] = {}
+        manifest["compressor"] = compressor
+
+    # A bundle left from an earlier WEB_BUILD_BUNDLE=1 run would still be
+    # packed into the LittleFS image
+    if not BUNDLE_ENABLED:
+        for name in (BUNDLE_NAME, BUNDLE_INDEX_NAME):
+            stale_bundle = join(data_root_dir, name)
+            if os.path.exists(stale_bundle):
+                os.remove(stale_bundle)
+
+    early = {}
 
     # Step 1: Build Preact web UI
     if os.path.exists(web_ui_dir):
-        print("\n[1/3] Building Preact web UI...")
-        try:
-            result = subprocess.run(
+        dist_dir = join(web_ui_dir, "dist")
+        web_ui_hash = _web_ui_hash(web_ui_dir)
+        if web_ui_hash == manifest["web_ui_hash"] and os.path.exists(dist_dir):
+            print("\n[1/3] Web UI sources unchanged, skipping npm build...")
+        else:
+            print("\n[1/3] Building Preact web UI...")
+            baseline = _snapshot(dist_dir)
+            proc = subprocess.Popen(
                 ["npm", "run", "build"],
                 cwd=web_ui_dir,
-                capture_output=True,
-                text=True,
-                check=True
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
             )
+
+            # Overlap local setup with the npm build: output dir + worker startup
+            os.makedirs(data_root_dir, exist_ok=True)
+            executor.submit(os.getpid)
+
+            # Compress dist/ output while npm is still emitting files
+            stdout, stderr, early = _compress_during_build(
+                proc, dist_dir, data_root_dir, executor, baseline)
+            if proc.returncode != 0:
+                _discard_early(early)
+                print(f"✗ Error building web UI: {stderr}")
+                return
             print("✓ Web UI built successfully")
-        except subprocess.CalledProcessError as e:
-            print(f"✗ Error building web UI: {e.stderr}")
-            return
+            manifest["web_ui_hash"] = web_ui_hash
 
         # Copy dist to data/www
-        dist_dir = join(web_ui_dir, "dist")
         if os.path.exists(dist_dir):
-            if os.path.exists(data_www_dir):
-                shutil.rmtree(data_www_dir)
-            shutil.copytree(dist_dir, data_www_dir)
-            print(f"✓ Copied build output to {data_www_dir}")
+            dist_hash = _dist_hash(dist_dir)
+            if (dist_hash == manifest["dist_hash"] and os.path.exists(data_www_dir)
+                    and _outputs_present(manifest, _list_outputs(data_root_dir))):
+                _discard_early(early)
+                _save_manifest(manifest_path, manifest)
+                print("✓ Build output unchanged, skipping copy and compression")
+                print(BANNER)
+                return
+            manifest["dist_hash"] = dist_hash
+
+            copied, removed = _sync_tree(dist_dir, data_www_dir)
+            print(f"✓ Synced build output to {data_www_dir} ({copied} copied, {removed} removed)")
     else:
         print(f"\n[1/3] No web-ui directory found, skipping build...")
 
     # Step 2: Compress web files
     if not os.path.exists(data_www_dir):
+        _discard_early(early)
         print(f"\n[2/3] No web source directory found at {data_www_dir}, skipping...")
         return
 
     print("\n[2/3] Compressing web files...")
-    file_count = 0
+    unchanged_count = 0
+    total_size = 0
+    br_count = 0
+    br_total_size = 0
     compressed_files = []
 
-    for root, dirs, files in os.walk(data_www_dir):
-        for filename in files:
-            if filename.endswith(('.html', '.css', '.js', '.json')):
-                src_path = join(root, filename)
-                rel_path = os.path.relpath(src_path, data_www_dir)
+    # Collect (src, dst, size) jobs, each file is an independent gzip stream
+    jobs = []
+    ready = []
+    old_entries = manifest["files"]
+    new_entries = {}
+    outputs = _list_outputs(data_root_dir)
+
+    # Outputs are flattened into data/ by basename; two jobs for the same
+    # .gz would write it concurrently, so keep only the last source in
+    # top-down walk order (the deeper file), as the sequential loop did
+    by_output = {}
+    for entry in sorted(_scan(data_www_dir), key=lambda e: (e.path.count(os.sep), e.path)):
+        previous = by_output.get(entry.name)
+        if previous is not None:
+            print(f"⚠️  {os.path.relpath(previous.path, data_www_dir)} and "
+                  f"{os.path.relpath(entry.path, data_www_dir)} both map to {entry.name}.gz, "
+                  f"keeping {os.path.relpath(entry.path, data_www_dir)}")
+        by_output[entry.name] = entry
+
+    try:
+        for entry in by_output.values():
+            src_path = entry.path
+            rel_path = os.path.relpath(src_path, data_www_dir)
+
+            # Compress and save to data root with .gz extension
+            dst_path = join(data_root_dir, entry.name + '.gz')
+
+            # Skip files whose (mtime, size) match the last build
+            st = entry.stat()
+            file_entry = _file_entry(st)
+            new_entries[rel_path] = file_entry
+            if (old_entries.get(rel_path) == file_entry
+                    and all(entry.name + suffix in outputs for suffix in OUTPUT_SUFFIXES)):
+                unchanged_count += 1
+                continue
+
+            # Reuse output compressed during the npm build if the copy matches
+            if rel_path in early and early[rel_path][0] == file_entry:
+                _, future, tmp_path = early.pop(rel_path)
+                try:
+                    dst_size, br_size = future.result()[3:]
+                except OSError:
+                    # Source changed under the early job; compress the copy instead
+                    _remove_tmp(tmp_path)
+                else:
+                    os.replace(tmp_path, dst_path)
+                    if br_size is not None:
+                        os.replace(br_path(tmp_path), br_path(dst_path))
+                    ready.append((src_path, dst_path, st.st_size, dst_size, br_size))
+                    continue
+
+            jobs.append((src_path, dst_path, st.st_size))
+    finally:
+        # Also on errors: leftover .tmp files would be packed into LittleFS
+        _discard_early(early)
 
-                # Compress and save to data root with .gz extension
-                dst_filename = filename + '.gz'
-                dst_path = join(data_root_dir, dst_filename)
+    # Remove .gz/.br outputs whose source file is gone
+    removed_outputs = 0
+    live_outputs = {os.path.basename(rel_path) for rel_path in new_entries}
+    for rel_path in old_entries:
+        filename = os.path.basename(rel_path)
+        if filename in live_outputs:
+            continue
+        for suffix in OUTPUT_SUFFIXES:
+            if filename + suffix in outputs:
+                os.remove(join(data_root_dir, filename + suffix))
+                outputs.discard(filename + suffix)
+                removed_outputs += 1
 
-                # Compress file
-                with open(src_path, 'rb') as f_in:
-                    with gzip.open(dst_path, 'wb', compresslevel=9) as f_out:
-                        shutil.copyfileobj(f_in, f_out)
+    # Compress in parallel, collect results and report once at the end
+    results = itertools.chain(ready, executor.map(compress_one, jobs, chunksize=4))
+    for src_path, dst_path, src_size, dst_size, br_size in results:
+        compressed_files.append((os.path.basename(src_path), os.path.basename(dst_path), src_size, dst_size, br_size))
+        total_size += dst_size
+        if br_size is not None:
+            br_count += 1
+            br_total_size += br_size
 
-                src_size = os.path.getsize(src_path)
-                dst_size = os.path.getsize(dst_path)
-                compression_ratio = (1 - dst_size / src_size) * 100
+    bundle_size = None
+    if BUNDLE_ENABLED and (compressed_files or removed_outputs or BUNDLE_NAME not in outputs):
+        bundle_size = _write_bundle(data_www_dir, data_root_dir)
 
-                print(f"  {filename} → {dst_filename}: {src_size} → {dst_size} bytes ({compression_ratio:.1f}% saved)")
-                file_count += 1
-                compressed_files.append(dst_filename)
+    manifest["files"] = new_entries
+    _save_manifest(manifest_path, manifest)
 
+    lines = []
+    for filename, dst_filename, src_size, dst_size, br_size in compressed_files:
+        compression_ratio = (1 - dst_size / src_size) * 100 if src_size else 0.0
+        line = f"  {filename} → {dst_filename}: {src_size} → {dst_size} bytes ({compression_ratio:.1f}% saved)"
+        if br_size is not None:
+            line += f", .br {br_size} bytes"
+        lines.append(line)
 
     # Step 3: Summary
-    print(f"\n[3/3] Summary:")
-    print(f"  Compressed files: {file_count}")
-    print(f"  Output directory: {data_root_dir}")
-    print(f"  Files ready for LittleFS upload:")
-    for f in compressed_files:
-        file_path = join(data_root_dir, f)
-        size = os.path.getsize(file_path)
-        print(f"    - {f} ({size} bytes)")
-
-    print("\n✓ Web UI ready for upload!")
-    print("  Run: pio run --target uploadfs")
-    print("=" * 60)
+    lines.append(f"\n[3/3] Summary:")
+    lines.append(f"  Compressed files: {len(compressed_files)}")
+    lines.append(f"  Unchanged files: {unchanged_count}")
+    lines.append(f"  Compressed size: {total_size} bytes ({total_size/1024:.1f} KB)")
+    if BROTLI_ENABLED:
+        lines.append(f"  Brotli files: {br_count} ({br_total_size} bytes)")
+    if bundle_size is not None:
+        lines.append(f"  Bundle: {BUNDLE_NAME} ({bundle_size} bytes) + {BUNDLE_INDEX_NAME}")
+    lines.append(f"  Output directory: {data_root_dir}")
+    lines.append("\n✓ Web UI ready for upload!")
+    lines.append("  Run: pio run --target uploadfs")
+    lines.append(BANNER)
+    sys.stdout.write("\n".join(lines) + "\n")
 # Register the callback
 env.AddPreAction("$BUILD_DIR/src/main.cpp.o", build_and_prepare_web_ui)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Web asset compression workers for tools/web_build.py
+Kept in a regular importable module so ProcessPoolExecutor can pickle
+the worker function (SCons execs web_build.py as SCons.Script)
+"""
+
+import os
+import zlib
+import shutil
+import subprocess
+
+# libdeflate is faster than zlib at a better ratio; fall back to stdlib zlib
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+# zopfli squeezes out a few more percent at a large CPU cost; opt-in for
+# release builds with WEB_BUILD_ZOPFLI=1
+try:
+    import zopfli.gzip
+except ImportError:
+    zopfli = None
+
+ZOPFLI_REQUESTED = os.environ.get("WEB_BUILD_ZOPFLI") == "1"
+
+# pigz parallelizes deflate across threads, one block per thread; only
+# worth the fork/exec for files spanning at least two blocks
+PIGZ = shutil.which("pigz")
+PIGZ_BLOCK_KB = 128
+PIGZ_MIN_SIZE = 2 * PIGZ_BLOCK_KB * 1024
+
+# Brotli variants for Accept-Encoding: br clients; opt-in since each one
+# takes LittleFS space next to the .gz
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BROTLI_REQUESTED = os.environ.get("WEB_BUILD_BROTLI") == "1"
+BROTLI_ENABLED = BROTLI_REQUESTED and brotli is not None
+OUTPUT_SUFFIXES = ('.gz', '.br') if BROTLI_ENABLED else ('.gz',)
+
+if ZOPFLI_REQUESTED and zopfli is not None:
+    GZIP_BACKEND = "zopfli"
+elif deflate is not None:
+    GZIP_BACKEND = "libdeflate"
+else:
+    GZIP_BACKEND = "zlib"
+
+def write_file(path, data):
+    """Write data to path with a single buffer (no file object layering)"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def gzip_bytes(raw):
+    """Compress raw bytes to a gzip stream with the selected backend"""
+    # pigz matches zlib -9 and zopfli (its -11 mode) output size, so it only
+    # stands in for those; libdeflate level 12 is smaller than pigz -9
+    if PIGZ and GZIP_BACKEND != "libdeflate" and len(raw) >= PIGZ_MIN_SIZE:
+        # -n leaves name/mtime out of the header
+        level = "-11" if GZIP_BACKEND == "zopfli" else "-9"
+        compressed = subprocess.run(
+            [PIGZ, level, "-n", "-b", str(PIGZ_BLOCK_KB), "-c"],
+            input=raw,
+            stdout=subprocess.PIPE,
+            check=True
+        ).stdout
+    elif GZIP_BACKEND == "zopfli":
+        compressed = zopfli.gzip.compress(raw, numiterations=15)
+    elif GZIP_BACKEND == "libdeflate":
+        # Level 12 is libdeflate's maximum (tighter than zlib level 9)
+        compressed = deflate.gzip_compress(raw, 12)
+    else:
+        # Raw zlib call (no GzipFile layer) releases the GIL while compressing;
+        # wbits=31 writes a gzip header with mtime 0 for reproducible output
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        compressed = compressor.compress(raw) + compressor.flush()
+    return compressed
+
+def br_path(gz_path):
+    """Brotli output path for a .gz (or .gz.tmp) output path"""
+    head, _, tail = gz_path.rpartition('.gz')
+    return head + '.br' + tail
+
+def compress_one(job):
+    """Compress a single file to .gz (and .br); runs in a pool worker"""
+    src_path, dst_path, src_size = job
+    with open(src_path, 'rb') as f_in:
+        raw = f_in.read()
+    compressed = gzip_bytes(raw)
+    write_file(dst_path, compressed)
+    br_size = None
+    if BROTLI_ENABLED:
+        br_data = brotli.compress(raw, quality=11, mode=brotli.MODE_TEXT)
+        write_file(br_path(dst_path), br_data)
+        br_size = len(br_data)
+    return (src_path, dst_path, src_size, len(compressed), br_size)